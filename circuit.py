@@ -3,6 +3,19 @@ import numpy as np
 
 from gate_tools import GATE_SYMBOLS
 
+# Three character diagram cells, looked up by code when rendering
+SYMBOLS = ["---", "-|-", "[M]"]
+WIRE_CODE = 1
+MEASUREMENT_CODE = 2
+SYMBOL_CODES = {}
+
+for gate_name, gate_symbols in GATE_SYMBOLS.items():
+    for index, symbol in enumerate(gate_symbols):
+        SYMBOL_CODES[(gate_name, index)] = len(SYMBOLS)
+        SYMBOLS.append(symbol)
+
+SYMBOL_CHARS = np.array([list(symbol.encode("ascii")) for symbol in SYMBOLS], dtype = np.uint8)
+
 class Instruction(ABC):
 
     @abstractmethod
@@ -107,24 +120,90 @@ class Circuit:
 
     def get_instructions(self) -> list:
         return self.instructions
+
+    def get_final_measurements(self) -> tuple:
+        # (index of the first instruction, measured qubits in order) of the trailing block of
+        # Z measurements with phase 1, as appended by measure_all
+
+        start = len(self.instructions)
+
+        while(start > 0 and not self.instructions[start - 1].is_gate()
+              and set(self.instructions[start - 1].get_operator()) == {"Z"}
+              and self.instructions[start - 1].get_phase() == 1):
+            start -= 1
+
+        qubits = [qubit_no for instruction in self.instructions[start:] for qubit_no in instruction.get_qubits()]
+        return start, qubits
     
-    def show(self):
-
-        for qubit in range(self.n_qubits):
-
-            print(f"{qubit}: |0> ", end = "")
-            
-            for instruction in self.instructions:
-
-                if(qubit in instruction.get_qubits()):
-                    if(instruction.is_gate()):
-                        index = instruction.get_qubits().index(qubit)
-                        print(instruction.get_symbol()[index], end = "")
-                    else:
-                        print("[M]", end = "")
-
-                else:
-                    print("---", end = "")
-            
-            print()
-            
+    def get_moments(self) -> list:
+        # Moment of every instruction, scheduled as early as possible.
+        # Multi qubit gates block all qubits between their outermost qubits.
+
+        frontier = [0] * self.n_qubits
+        moments = []
+
+        for instruction in self.instructions:
+            qubits = instruction.get_qubits()
+
+            if(len(qubits) == 1):
+                moment = frontier[qubits[0]]
+                frontier[qubits[0]] = moment + 1
+            else:
+                low, high = min(qubits), max(qubits) + 1
+                moment = max(frontier[low:high])
+                frontier[low:high] = [moment + 1] * (high - low)
+
+            moments.append(moment)
+
+        return moments
+
+    def render(self, qubit_range: tuple = None, moment_range: tuple = None) -> str:
+        # Diagram of the circuit compressed into moments, optionally windowed to
+        # qubits [start, stop) and moments [start, stop)
+
+        moments = self.get_moments()
+        n_moments = max(moments) + 1 if moments else 0
+
+        q_start, q_stop = qubit_range if qubit_range is not None else (0, self.n_qubits)
+        m_start, m_stop = moment_range if moment_range is not None else (0, n_moments)
+        q_start, q_stop = max(q_start, 0), min(q_stop, self.n_qubits)
+        m_start, m_stop = max(m_start, 0), min(m_stop, n_moments)
+
+        # nothing to draw outside of the circuit
+        if(q_start >= q_stop or (m_start >= m_stop and moment_range is not None)):
+            return ""
+
+        codes = np.zeros((q_stop - q_start, max(m_stop - m_start, 0)), dtype = np.uint16)
+
+        for instruction, moment in zip(self.instructions, moments):
+            if(moment < m_start or moment >= m_stop):
+                continue
+
+            column = moment - m_start
+            qubits = instruction.get_qubits()
+
+            if(instruction.is_gate()):
+                if(len(qubits) > 1):
+                    low, high = max(min(qubits), q_start), min(max(qubits) + 1, q_stop)
+                    codes[low - q_start:high - q_start, column] = WIRE_CODE
+
+                for index, qubit in enumerate(qubits):
+                    if(q_start <= qubit < q_stop):
+                        codes[qubit - q_start, column] = SYMBOL_CODES[(instruction.get_name(), index)]
+            else:
+                for qubit in qubits:
+                    if(q_start <= qubit < q_stop):
+                        codes[qubit - q_start, column] = MEASUREMENT_CODE
+
+        chars = SYMBOL_CHARS[codes].reshape(codes.shape[0], 3 * codes.shape[1])
+        head = "... " if m_start > 0 else ""
+        tail = " ..." if m_stop < n_moments else ""
+
+        lines = [f"{qubit}: |0> " + head + row.tobytes().decode("ascii") + tail
+                 for qubit, row in zip(range(q_start, q_stop), chars)]
+
+        return "\n".join(lines)
+
+    def show(self, qubit_range: tuple = None, moment_range: tuple = None):
+        print(self.render(qubit_range = qubit_range, moment_range = moment_range))
+
@@ -0,0 +1,209 @@
+import time
+import numpy as np
+
+from circuit import Circuit
+from simulator import MatrixSimulator
+from statevector import StateVectorSimulator
+
+# Randomized differential testing of stabilizer backends against the dense state vector reference.
+# A backend provides execute(circuit) -> state and sample(circuit, shots, rng) like MatrixSimulator,
+# where the state provides get_pauli_strings() and sample_bitstrings(k, rng) like CheckMatrixState.
+
+SINGLE_QUBIT_GATES = ["H", "S", "X", "Y", "Z"]
+STRING_PHASES = {"": 1, "-": -1, "i": 1j, "-i": -1j}
+
+def default_backends() -> dict:
+    return {"matrix": MatrixSimulator()}
+
+def random_circuit(n_qubits: int, n_gates: int, rng: np.random.Generator,
+                   gates: list = SINGLE_QUBIT_GATES + ["CX"],
+                   measurement_probability: float = 0, measure_all: bool = False) -> Circuit:
+    # every instruction is a single qubit X, Y or Z measurement with random sign with
+    # probability `measurement_probability`, otherwise a gate
+
+    circuit = Circuit(n_qubits)
+
+    for gate_name in rng.choice(gates, size = n_gates):
+        if(measurement_probability > 0 and rng.random() < measurement_probability):
+            circuit.measure([int(rng.integers(n_qubits))], str(rng.choice(["X", "Y", "Z"])),
+                            int(rng.choice([1, -1])))
+        elif(gate_name == "CX"):
+            if(n_qubits < 2):
+                continue
+            control_qubit, target_qubit = rng.choice(n_qubits, size = 2, replace = False)
+            circuit.cx(int(control_qubit), int(target_qubit))
+        else:
+            getattr(circuit, gate_name.lower())(int(rng.integers(n_qubits)))
+
+    if(measure_all):
+        circuit.measure_all()
+
+    return circuit
+
+def split_phase(stabilizer: str) -> tuple:
+    # "-iXYZ" -> (-1j, "XYZ")
+
+    pauli_start = len(stabilizer) - len(stabilizer.lstrip("-i"))
+    return STRING_PHASES[stabilizer[:pauli_start]], stabilizer[pauli_start:]
+
+def check_stabilizers(state, reference, tolerance: float = 1e-6) -> list:
+    # every stabilizer g has to satisfy <psi|g|psi> = 1 on the reference state
+
+    failures = []
+
+    for stabilizer in state.get_pauli_strings():
+        phase, pauli_string = split_phase(stabilizer)
+        expectation = reference.expectation(pauli_string, phase)
+
+        if(abs(expectation - 1) > tolerance):
+            failures.append(f"stabilizer {stabilizer} has expectation {np.round(expectation, 6)}")
+
+    return failures
+
+def chi_square_bound(dof: int, sigmas: float) -> float:
+    # Wilson-Hilferty approximation of the chi-square quantile `sigmas` standard deviations out
+    return dof * (1 - 2 / (9 * dof) + sigmas * np.sqrt(2 / (9 * dof))) ** 3
+
+def check_samples(samples: np.ndarray, probabilities: np.ndarray, sigmas: float = 5,
+                  min_expected: float = 5) -> list:
+    # samples (shots, n) against a Z-basis distribution of shape [2] * n: support, chi-square test of
+    # the full histogram, single qubit marginals and two qubit parities up to `sigmas` standard errors
+
+    failures = []
+    shots, n_qubits = samples.shape
+    probabilities = probabilities.reshape(-1)
+
+    indices = np.zeros((shots,), dtype = int)
+    if(n_qubits > 0):
+        indices = np.ravel_multi_index(tuple(samples.T), (2,) * n_qubits)
+
+    outside = probabilities[indices] < 1e-9
+    if(outside.any()):
+        bitstring = "".join(str(bit) for bit in samples[np.argmax(outside)])
+        failures.append(f"{outside.sum()} samples outside of support, e.g. {bitstring}")
+
+    # bins below `min_expected` counts are merged into one
+    observed = np.bincount(indices, minlength = len(probabilities))
+    expected = shots * probabilities
+    large = expected >= min_expected
+
+    observed_bins = np.append(observed[large], observed[~large].sum())
+    expected_bins = np.append(expected[large], expected[~large].sum())
+    nonzero = expected_bins > 0
+
+    dof = np.count_nonzero(nonzero) - 1
+    if(dof > 0):
+        chi_square = np.sum((observed_bins[nonzero] - expected_bins[nonzero]) ** 2 / expected_bins[nonzero])
+        if(chi_square > chi_square_bound(dof, sigmas)):
+            failures.append(f"histogram chi-square {chi_square:.1f} exceeds bound for {dof} degrees of freedom")
+
+    # <(-1)^(b_i + b_j)>, the diagonal holds the single qubit marginals <(-1)^b_i>
+    outcomes = (np.arange(len(probabilities))[:, None] >> np.arange(n_qubits - 1, -1, -1)) & 1
+    signs = 1 - 2 * outcomes.astype(float)
+    expected_parities = (signs * probabilities[:, None]).T @ signs
+    expected_parities[np.diag_indices(n_qubits)] = probabilities @ signs
+
+    sample_signs = 1 - 2 * samples.astype(float)
+    observed_parities = sample_signs.T @ sample_signs / shots
+    observed_parities[np.diag_indices(n_qubits)] = sample_signs.mean(axis = 0)
+
+    bound = sigmas * np.sqrt(np.maximum(1 - expected_parities ** 2, 1 / shots) / shots)
+    deviating = np.abs(observed_parities - expected_parities) > bound
+
+    for qubit_1, qubit_2 in zip(*np.nonzero(np.triu(deviating))):
+        label = f"qubit {qubit_1}" if qubit_1 == qubit_2 else f"qubits {qubit_1}, {qubit_2} parity"
+        failures.append(f"{label} has expectation {observed_parities[qubit_1, qubit_2]:.3f}, "
+                        f"expected {expected_parities[qubit_1, qubit_2]:.3f}")
+
+    return failures
+
+def measured_distribution(probabilities: np.ndarray, qubits: list) -> np.ndarray:
+    # distribution of the Z outcomes of `qubits` (in order, repetitions allowed), shape [2] * len(qubits)
+
+    n_qubits = probabilities.ndim
+    outcomes = (np.arange(2 ** n_qubits)[:, None] >> (n_qubits - 1 - np.array(qubits, dtype = int))) & 1
+    indices = outcomes @ (1 << np.arange(len(qubits) - 1, -1, -1))
+
+    distribution = np.zeros((2 ** len(qubits),))
+    np.add.at(distribution, indices, probabilities.reshape(-1))
+
+    return distribution.reshape((2,) * len(qubits))
+
+def run(n_circuits: int = 100, max_qubits: int = 8, max_gates: int = 40, shots: int = 1000,
+        seed: int = None, backends: dict = None, measurement_probability: float = 0.1) -> dict:
+    # Even circuits are unitary, their stabilizers and sample_bitstrings are checked.
+    # Odd circuits contain measurements and end in measure_all, the outcomes of sample are
+    # checked against the reference distribution averaged over all measurement outcomes.
+    # returns {"timings": {name: seconds}, "failures": [(circuit_no, backend, message)]}
+
+    if(backends is None):
+        backends = default_backends()
+
+    # circuits only depend on the seed, samples of circuit i only on the seed and i,
+    # so a failure reproduces with any other set of backends
+    circuit_seed, sample_seed = np.random.SeedSequence(seed).spawn(2)
+    circuit_rng = np.random.default_rng(circuit_seed)
+    sample_seeds = sample_seed.spawn(n_circuits)
+
+    reference_simulator = StateVectorSimulator()
+
+    timings = {name: 0.0 for name in ["reference"] + list(backends)}
+    failures = []
+
+    for circuit_no in range(n_circuits):
+        with_measurements = circuit_no % 2 == 1 and measurement_probability > 0
+
+        n_qubits = int(circuit_rng.integers(1, max_qubits + 1))
+        circuit = random_circuit(n_qubits, int(circuit_rng.integers(0, max_gates + 1)), circuit_rng,
+                                 measurement_probability = measurement_probability if with_measurements else 0,
+                                 measure_all = with_measurements)
+
+        measured = list(range(n_qubits))
+
+        start = time.perf_counter()
+        if(with_measurements):
+            # a random Z measurement right before measure_all joins the final measurements,
+            # the reference stops branching where they begin
+            final_start, measured = circuit.get_final_measurements()
+            probabilities = measured_distribution(reference_simulator.get_distribution(circuit, final_start), measured)
+        else:
+            reference = reference_simulator.execute(circuit)
+            probabilities = reference.get_probabilities()
+        timings["reference"] += time.perf_counter() - start
+
+        for name, backend in backends.items():
+            rng = np.random.default_rng(sample_seeds[circuit_no])
+
+            start = time.perf_counter()
+            if(with_measurements):
+                samples = backend.sample(circuit, shots, rng)
+            else:
+                state = backend.execute(circuit)
+                samples = state.sample_bitstrings(shots, rng)
+            timings[name] += time.perf_counter() - start
+
+            if(samples.shape != (shots, len(measured))):
+                messages = [f"samples have shape {samples.shape}, expected {(shots, len(measured))}"]
+            else:
+                messages = check_samples(samples, probabilities)
+
+            if not (with_measurements):
+                messages = check_stabilizers(state, reference) + messages
+
+            failures += [(circuit_no, name, message) for message in messages]
+
+    return {"timings": timings, "failures": failures}
+
+def print_report(report: dict):
+
+    for name, seconds in report["timings"].items():
+        print(f"{name}: {seconds:.3f} s")
+
+    for circuit_no, name, message in report["failures"]:
+        print(f"circuit {circuit_no} [{name}]: {message}")
+
+    print(f"{len(report['failures'])} failures")
+
+
+if __name__ == '__main__':
+    print_report(run(seed = 0))
@@ -1,7 +1,10 @@
 import unittest
+import numpy as np
 
 from circuit import Circuit
 from simulator import MatrixSimulator
+from statevector import StateVectorSimulator, MAX_QUBITS
+import differential
 
 class TestMatrixSimulator(unittest.TestCase):
 
@@ -179,6 +182,270 @@ class TestMatrixSimulator(unittest.TestCase):
 
         print("Measurement tests - passed")
 
+    def test_entangled_measurement(self):
+        # GHZ state: first outcome is random, the others have to agree with it
+        simulator = MatrixSimulator()
+        circuit = Circuit(n_qubits=3)
+        circuit.h(0)
+        circuit.cx(0, 1)
+        circuit.cx(1, 2)
+        state = simulator.execute(circuit)
+
+        first = state.apply_measurement([0], "Z", 1)
+        self.assertEqual(state.apply_measurement([2], "Z", 1), first)
+        self.assertEqual(state.apply_measurement([1], "Z", -1), -first)
+
+        # |101> stabilized by -Z0, -Z1Z2, -Z2: Z1 is only fixed by a product of generators
+        circuit = Circuit(n_qubits=3)
+        circuit.x(0)
+        circuit.x(1)
+        circuit.x(2)
+        circuit.cx(2, 1)
+        state = simulator.execute(circuit)
+        self.assertEqual(state.apply_measurement([1], "Z", 1), 1)
+
+        # Consecutive deterministic measurements share one elimination of the check matrix
+        circuit = Circuit(n_qubits=3)
+        circuit.h(0)
+        circuit.cx(0, 1)
+        circuit.cx(1, 2)
+        state = simulator.execute(circuit)
+        first = state.apply_measurement([0], "Z", 1)
+        reduction = state.get_reduction()
+        self.assertEqual(state.apply_measurement([1], "Z", 1), first)
+        self.assertIs(state.get_reduction()[1], reduction[1])
+
+        # Random outcomes are reproducible through a seeded rng and through np.random.seed
+        circuit = Circuit(n_qubits=8)
+        for qubit_no in range(8):
+            circuit.h(qubit_no)
+        circuit.measure_all()
+
+        runs = [simulator.execute(circuit, np.random.default_rng(seed=3)).get_pauli_strings() for _ in range(2)]
+        self.assertEqual(runs[0], runs[1])
+
+        runs = []
+        for _ in range(2):
+            np.random.seed(3)
+            runs.append(simulator.execute(circuit).get_pauli_strings())
+        self.assertEqual(runs[0], runs[1])
+
+        print("Entangled measurement tests - passed")
+
+    def test_sample_bitstrings(self):
+        simulator = MatrixSimulator()
+        rng = np.random.default_rng(seed=7)
+
+        # Basis state |10>
+        circuit = Circuit(n_qubits=2)
+        circuit.x(0)
+        samples = simulator.execute(circuit).sample_bitstrings(16, rng)
+        self.assertEqual(samples.shape, (16, 2))
+        self.assertTrue((samples == [1, 0]).all())
+
+        # GHZ state (|000> + |111>) / sqrt(2), sampling leaves the state untouched
+        circuit = Circuit(n_qubits=3)
+        circuit.h(0)
+        circuit.cx(0, 1)
+        circuit.cx(1, 2)
+        state = simulator.execute(circuit)
+        stabs = state.get_pauli_strings()
+
+        samples = state.sample_bitstrings(1000, rng)
+        self.assertTrue((samples == samples[:, :1]).all())
+        self.assertGreater(samples[:, 0].sum(), 400)
+        self.assertLess(samples[:, 0].sum(), 600)
+        self.assertEqual(state.get_pauli_strings(), stabs)
+
+        # Y eigenstate with a -1 parity constraint: (|01> - |10>) stabilized by -ZZ
+        circuit = Circuit(n_qubits=2)
+        circuit.x(1)
+        circuit.h(0)
+        circuit.s(0)
+        circuit.cx(0, 1)
+        samples = simulator.execute(circuit).sample_bitstrings(200, rng)
+        self.assertTrue((samples[:, 0] != samples[:, 1]).all())
+
+        # Trailing measure_all is replaced by sampling
+        circuit = Circuit(n_qubits=2)
+        circuit.h(0)
+        circuit.cx(0, 1)
+        circuit.x(1)
+        circuit.measure_all()
+        samples = simulator.sample(circuit, 200, rng)
+        self.assertTrue((samples[:, 0] != samples[:, 1]).all())
+
+        # Only the trailing measurements are returned, in measurement order
+        circuit = Circuit(n_qubits=3)
+        circuit.x(2)
+        circuit.measure([2, 1], "ZZ")
+        samples = simulator.sample(circuit, 10, rng)
+        self.assertEqual(samples.shape, (10, 2))
+        self.assertTrue((samples == [1, 0]).all())
+
+        # A measurement in the middle is redrawn for every shot
+        circuit = Circuit(n_qubits=2)
+        circuit.h(0)
+        circuit.measure([0], "Z")
+        circuit.cx(0, 1)
+        circuit.measure_all()
+        samples = simulator.sample(circuit, 1000, rng)
+        self.assertTrue((samples[:, 0] == samples[:, 1]).all())
+        self.assertGreater(samples[:, 0].sum(), 400)
+        self.assertLess(samples[:, 0].sum(), 600)
+
+        # No shots, with and without a measurement in the middle
+        circuit = Circuit(n_qubits=2)
+        circuit.h(0)
+        circuit.h(1)
+        circuit.measure_all()
+        self.assertEqual(simulator.sample(circuit, 0, rng).shape, (0, 2))
+
+        circuit = Circuit(n_qubits=2)
+        circuit.h(0)
+        circuit.measure([0], "Z")
+        circuit.h(1)
+        circuit.measure_all()
+        samples = simulator.sample(circuit, 0, rng)
+        self.assertEqual(samples.shape, (0, 2))
+        self.assertEqual(samples.dtype, np.uint8)
+
+        print("Sampling tests - passed")
+
+    def test_pauli_export(self):
+        simulator = MatrixSimulator()
+
+        circuit = Circuit(n_qubits=3)
+        circuit.h(0)
+        circuit.s(0)
+        circuit.cx(0, 1)
+        circuit.x(2)
+        state = simulator.execute(circuit)
+
+        paulis = state.get_pauli_array()
+        self.assertEqual(paulis.shape, (3, 3))
+        self.assertEqual(paulis.tobytes(), b"YXIZZIIIZ")
+        self.assertEqual(state.get_pauli_strings(), ["YXI", "ZZI", "-IIZ"])
+
+        print("Pauli export tests - passed")
+
+    def test_circuit_rendering(self):
+        circuit = Circuit(n_qubits=3)
+        circuit.h(0)
+        circuit.h(1)
+        circuit.cx(0, 2)
+        circuit.x(1)
+        circuit.measure_all()
+
+        self.assertEqual(circuit.get_moments(), [0, 0, 1, 2, 2, 3, 2])
+        self.assertEqual(circuit.render().split("\n"),
+                         ["0: |0> [H][o][M]---",
+                          "1: |0> [H]-|-[X][M]",
+                          "2: |0> ---[+][M]---"])
+
+        # Window to qubits [1, 3) and moments [1, 2)
+        self.assertEqual(circuit.render(qubit_range=(1, 3), moment_range=(1, 2)).split("\n"),
+                         ["1: |0> ... -|- ...",
+                          "2: |0> ... [+] ..."])
+
+        # Empty windows
+        self.assertEqual(circuit.render(qubit_range=(5, 7)), "")
+        self.assertEqual(circuit.render(moment_range=(4, 6)), "")
+        self.assertEqual(Circuit(n_qubits=0).render(), "")
+        self.assertEqual(Circuit(n_qubits=2).render(), "0: |0> \n1: |0> ")
+
+        print("Circuit rendering tests - passed")
+
+    def test_state_vector_reference(self):
+        simulator = StateVectorSimulator(np.random.default_rng(seed=1))
+
+        # Bell state (|00> + |11>) / sqrt(2)
+        circuit = Circuit(n_qubits=2)
+        circuit.h(0)
+        circuit.cx(0, 1)
+        state = simulator.execute(circuit)
+        np.testing.assert_allclose(state.get_probabilities(), [[0.5, 0], [0, 0.5]])
+        self.assertAlmostEqual(state.expectation("XX"), 1)
+        self.assertAlmostEqual(state.expectation("YY", -1), 1)
+        self.assertAlmostEqual(state.expectation("ZI"), 0)
+
+        # Measuring one half of the Bell state collapses the other
+        circuit.measure([0], "Z")
+        state = simulator.execute(circuit)
+        self.assertAlmostEqual(state.expectation("ZZ"), 1)
+        self.assertAlmostEqual(abs(state.expectation("ZI")), 1)
+
+        # Distribution over all measurement outcomes, the measurement prevents H H = I
+        circuit = Circuit(n_qubits=2)
+        circuit.h(0)
+        circuit.measure([0], "Z")
+        circuit.h(0)
+        circuit.cx(0, 1)
+        np.testing.assert_allclose(simulator.get_distribution(circuit), [[0.5, 0], [0, 0.5]])
+        np.testing.assert_allclose(differential.measured_distribution(simulator.get_distribution(circuit), [1, 1, 0]),
+                                   [[[0.5, 0], [0, 0]], [[0, 0], [0, 0.5]]])
+
+        print("State vector reference tests - passed")
+
+    def test_differential(self):
+        report = differential.run(n_circuits=30, max_qubits=6, max_gates=30, shots=500, seed=0)
+        self.assertEqual(report["failures"], [])
+        self.assertEqual(set(report["timings"]), {"reference", "matrix"})
+
+        # A backend dropping the last instruction has to be caught, with and without measurements
+        class FaultySimulator(MatrixSimulator):
+            def run_instructions(self, state, instructions, rng=None, verbose=True):
+                return super().run_instructions(state, instructions[:-1], rng, verbose)
+
+        report = differential.run(n_circuits=30, max_qubits=6, max_gates=30, shots=500, seed=0,
+                                  backends={"faulty": FaultySimulator()})
+        self.assertTrue(any(circuit_no % 2 == 0 for circuit_no, _, _ in report["failures"]))
+        self.assertTrue(any(circuit_no % 2 == 1 for circuit_no, _, _ in report["failures"]))
+
+        # Failures do not depend on which other backends run alongside
+        both = differential.run(n_circuits=30, max_qubits=6, max_gates=30, shots=500, seed=0,
+                                backends={"matrix": MatrixSimulator(), "faulty": FaultySimulator()})
+        self.assertEqual([failure for failure in both["failures"] if failure[1] == "faulty"],
+                         report["failures"])
+
+        # Correct support and marginals, but wrong correlations
+        rng = np.random.default_rng(seed=2)
+        uniform = np.full((2, 2, 2), 1 / 8)
+
+        even = rng.integers(0, 2, size=(2000, 3), dtype=np.uint8)
+        even[:, 2] = even[:, 0] ^ even[:, 1]
+        self.assertEqual(differential.check_samples(rng.integers(0, 2, size=(2000, 3)), uniform), [])
+        failures = differential.check_samples(even, uniform)
+        self.assertTrue(any("chi-square" in failure for failure in failures))
+
+        equal = np.repeat(rng.integers(0, 2, size=(2000, 1), dtype=np.uint8), 2, axis=1)
+        failures = differential.check_samples(equal, np.full((2, 2), 1 / 4), min_expected=np.inf)
+        self.assertEqual(failures, ["qubits 0, 1 parity has expectation 1.000, expected 0.000"])
+
+        # Circuits with measurements at MAX_QUBITS stay cheap for the reference
+        circuit = Circuit(n_qubits=MAX_QUBITS)
+        for qubit_no in range(MAX_QUBITS):
+            circuit.h(qubit_no)
+        circuit.measure([0], "Z")
+        circuit.measure([3], "X")
+        circuit.cx(0, 1)
+        circuit.measure_all()
+
+        final_start, measured = circuit.get_final_measurements()
+        probabilities = StateVectorSimulator().get_distribution(circuit, final_start)
+        samples = MatrixSimulator().sample(circuit, 2000, np.random.default_rng(seed=4))
+        self.assertEqual(differential.check_samples(samples, differential.measured_distribution(probabilities, measured)), [])
+
+        rng = np.random.default_rng(seed=5)
+        circuit = differential.random_circuit(MAX_QUBITS, 60, rng, measurement_probability=0.2, measure_all=True)
+
+        final_start, measured = circuit.get_final_measurements()
+        probabilities = StateVectorSimulator().get_distribution(circuit, final_start)
+        samples = MatrixSimulator().sample(circuit, 2000, rng)
+        self.assertEqual(differential.check_samples(samples, differential.measured_distribution(probabilities, measured)), [])
+
+        print("Differential tests - passed")
+
 
 if __name__ == '__main__':
     unittest.main()
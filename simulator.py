@@ -35,6 +35,34 @@ def phase_to_string(complex_number: np.complex64) -> str:
     
     raise RuntimeError(f"Invalid phase {complex_number}")
 
+# indexed by x + 2 * z of a check matrix entry
+PAULI_CHARS = np.frombuffer(b"IXZY", dtype = np.uint8)
+
+def product_phase_exponent(x1: np.ndarray, z1: np.ndarray, x2: np.ndarray, z2: np.ndarray) -> np.ndarray:
+    # exponent e (mod 4) of P_1 P_2 = i^e P_3 summed over the last axis, Y is stored as (1, 1)
+
+    x1, z1, x2, z2 = (np.asarray(a, dtype = np.int64) for a in (x1, z1, x2, z2))
+
+    exponent = np.where(x1 & z1, z2 - x2,
+               np.where(x1, z2 * (2 * x2 - 1),
+               np.where(z1, x2 * (1 - 2 * z2), 0)))
+
+    return np.sum(exponent, axis = -1) % 4
+
+def swap_rows(x: np.ndarray, z: np.ndarray, phase: np.ndarray, row1: int, row2: int):
+    x[[row1, row2]] = x[[row2, row1]]
+    z[[row1, row2]] = z[[row2, row1]]
+    phase[[row1, row2]] = phase[[row2, row1]]
+
+def multiply_rows(x: np.ndarray, z: np.ndarray, phase: np.ndarray, targets: np.ndarray, source: int):
+    # g_t -> g_s g_t for every target row t
+
+    exponent = product_phase_exponent(x[source], z[source], x[targets], z[targets])
+
+    phase[targets] = phase[targets] * phase[source] * (1j ** exponent)
+    x[targets] ^= x[source]
+    z[targets] ^= z[source]
+
 
 class CheckMatrixState:
     def __init__(self, n_qubits: int):
@@ -43,7 +71,16 @@ class CheckMatrixState:
         self.check_matrix = np.zeros((n_qubits, 2 * n_qubits), dtype = bool)
         self.phase = np.ones((n_qubits,), dtype = np.complex64)
         self.n_qubits = n_qubits
+
+        # cached by get_reduction
+        self.reduction = None
         
+    def copy(self) -> "CheckMatrixState":
+        state = CheckMatrixState(self.n_qubits)
+        state.check_matrix = self.check_matrix.copy()
+        state.phase = self.phase.copy()
+        return state
+
     def init_basis_state(self):
         # Initialize to |0..0> -> Z1,..,Zn state
 
@@ -68,65 +105,103 @@ class CheckMatrixState:
             self.set_stabilizer(new_stab=transformed_stab, stab_no=stab_no, qubits=qubits)
 
     
-    def apply_measurement(self, qubits: list, operator: str, phase: np.complex64) -> int:
-
-        anti_cummotors = []
-
-        for stab_no in range(self.n_qubits):
-            stab = self.get_stabilizer(stab_no=stab_no, qubits=qubits)
-
-            if not (pauli_tools.commute(pauli1=stab, pauli2=operator)):
-                anti_cummotors.append(stab_no)
-
-        # Case 1
-        if(len(anti_cummotors) == 0):
+    def apply_measurement(self, qubits: list, operator: str, phase: np.complex64,
+                          rng: np.random.Generator = None, outcome: int = None) -> int:
+        # measures phase * operator, returns the eigenvalue +1 / -1
+        # outcome fixes the result of a random measurement, deterministic ones ignore it
+
+        n = self.n_qubits
+        x = self.check_matrix[:, :n]
+        z = self.check_matrix[:, n:]
+
+        operator_x = np.zeros((n,), dtype = bool)
+        operator_z = np.zeros((n,), dtype = bool)
+        for qubit_no, pauli in zip(qubits, operator):
+            operator_x[qubit_no] = pauli in "XY"
+            operator_z[qubit_no] = pauli in "YZ"
+
+        symplectic = np.sum(x & operator_z, axis = 1) + np.sum(z & operator_x, axis = 1)
+        anti_commutors = np.flatnonzero(symplectic % 2)
+
+        # Case 1: operator (up to sign) is an element of the stabilizer group
+        if(len(anti_commutors) == 0):
+
+            stab_phase = self.get_group_phase(operator_x, operator_z)
+            return 1 if np.isclose(stab_phase, phase) else -1
+
+        # Case 2: random outcome, one anti commuting generator is replaced by the operator
+        anti_stab_no = anti_commutors[0]
+        multiply_rows(x, z, self.phase, anti_commutors[1:], anti_stab_no)
+
+        # without rng the global np.random state is used, so np.random.seed keeps runs reproducible
+        if(outcome is None and rng is None):
+            outcome = 1 if np.random.choice([True, False]) else -1
+        elif(outcome is None):
+            outcome = 1 if rng.random() < 0.5 else -1
+
+        x[anti_stab_no] = operator_x
+        z[anti_stab_no] = operator_z
+        self.phase[anti_stab_no] = outcome * phase
+        return outcome
+
+    def get_group_phase(self, pauli_x: np.ndarray, pauli_z: np.ndarray) -> np.complex64:
+        # phase p such that p * P is in the stabilizer group, P given by its check matrix row
+
+        n = self.n_qubits
+        pivot_cols, transform = self.get_reduction()
+        pauli = np.concatenate([pauli_x, pauli_z])
+
+        # the coefficient of a reduced pivot row is the operator bit in its pivot column,
+        # transform maps reduced rows back to the generators they are made of
+        coefficients = np.logical_xor.reduce(transform[pauli[pivot_cols]], axis = 0)
+
+        # g_1 g_2 ... g_k multiplied left to right, prefix[j] holds the bits of g_1 ... g_j
+        stab_nos = np.flatnonzero(coefficients)
+        rows = self.check_matrix[stab_nos]
+        prefix = np.logical_xor.accumulate(rows, axis = 0)
+        prefix = np.vstack([np.zeros((1, 2 * n), dtype = bool), prefix])
+
+        exponents = product_phase_exponent(prefix[:-1, :n], prefix[:-1, n:], rows[:, :n], rows[:, n:])
+        product_phase = np.prod(self.phase[stab_nos]) * (1j ** (np.sum(exponents) % 4))
+        product_x, product_z = prefix[-1, :n], prefix[-1, n:]
+
+        if((product_x != pauli_x).any() or (product_z != pauli_z).any()):
+            raise RuntimeError("Measurement operator should be part of Stabilizers")
 
-            op_sign = -1 if has_sign(phase) else 1
+        return product_phase
 
-            for stab_no in range(self.n_qubits):
+    def get_reduction(self) -> tuple:
+        # (pivot columns, transform) of the Gauss-Jordan form of the check matrix, reduced row r
+        # is the product of the generators set in transform[r]. Phases are not needed, so only bits
+        # are eliminated. The result is kept until the check matrix changes, which lets consecutive
+        # deterministic measurements share one elimination.
 
-                stab = self.get_stabilizer(stab_no=stab_no, qubits=qubits)
-                stab_sign = -1 if has_sign(self.phase[stab_no]) else 1
+        if(self.reduction is not None and np.array_equal(self.reduction[0], self.check_matrix)):
+            return self.reduction[1:]
 
-                if(stab == operator):
-                    
-                    if(op_sign == stab_sign):
-                        return 1
-                    
-                    else:
-                        return -1
-            
-            raise RuntimeError("Measurement operator should be part of Stabilizers")
+        n = self.n_qubits
+        rows = np.hstack([self.check_matrix, np.eye(n, dtype = bool)])
 
-        # Case 2
-        else:
-            anti_stab_no = anti_cummotors[0]
-            anti_stabilizer = self.get_stabilizer(stab_no = anti_stab_no, qubits=qubits)
+        pivot_cols = []
+        for col in range(2 * n):
+            rank = len(pivot_cols)
+            candidates = np.flatnonzero(rows[rank:, col])
+            if(len(candidates) == 0):
+                continue
 
-            anti_cummotors = anti_cummotors[1:]
-            while(len(anti_cummotors) > 0):
-                stab_no = anti_cummotors.pop()
+            pivot = rank + candidates[0]
+            rows[[rank, pivot]] = rows[[pivot, rank]]
 
-                anti_stabilizer_two = self.get_stabilizer(stab_no=stab_no, qubits=qubits)
-                new_phase, com_stabilizer = pauli_tools.multiply(pauli1=anti_stabilizer, 
-                                                            pauli2=anti_stabilizer_two,
-                                                            phase1=self.phase[anti_stab_no],
-                                                            phase2=self.phase[stab_no])
+            targets = np.flatnonzero(rows[:, col])
+            targets = targets[targets != rank]
+            rows[targets] ^= rows[rank]
 
-                self.set_stabilizer(com_stabilizer, stab_no=stab_no, qubits=qubits)
-                self.phase[stab_no] = new_phase
-            
-            # +1 Measurement Pr[+1] = 1/2
-            if(np.random.choice([True, False])):
-                self.set_stabilizer(new_stab=operator, stab_no=anti_stab_no, qubits=qubits)
-                self.phase[anti_stab_no] *= phase
-                return 1
+            pivot_cols.append(col)
+            if(len(pivot_cols) == n):
+                break
 
-            # -1 Measurement Pr[-1] = 1/2
-            else:
-                self.set_stabilizer(new_stab=operator, stab_no=anti_stab_no, qubits=qubits)
-                self.phase[anti_stab_no] *= -1 * phase
-                return -1
+        self.reduction = (self.check_matrix.copy(), pivot_cols, rows[:len(pivot_cols), 2 * n:])
+        return self.reduction[1:]
 
     def getPauli(self, stab_no:int, qubit_no:int) -> str:
         if(self.check_matrix[stab_no, qubit_no] == True and self.check_matrix[stab_no, self.n_qubits + qubit_no] == True):
@@ -176,24 +251,93 @@ class CheckMatrixState:
         else:
             raise RuntimeError(f"Unknown stabilizer: {new_stab}")
 
-    def get_pauli_strings(self) -> list:
-        stabilizers = []
+    def get_pauli_array(self) -> np.ndarray:
+        # (n_qubits, n_qubits) uint8 array of ASCII Pauli characters, row = stabilizer
 
-        for row in range(self.n_qubits):
-            stabilizer = str(phase_to_string(self.phase[row]))
+        x = self.check_matrix[:, :self.n_qubits]
+        z = self.check_matrix[:, self.n_qubits:]
 
-            for qubit_no in range(self.n_qubits):
-                stabilizer += self.getPauli(row, qubit_no)
-            stabilizers.append(stabilizer)
+        return PAULI_CHARS[x + 2 * z.astype(np.uint8)]
 
-        return stabilizers
+    def get_pauli_strings(self) -> list:
+        paulis = self.get_pauli_array()
+
+        return [phase_to_string(self.phase[row]) + paulis[row].tobytes().decode("ascii")
+                for row in range(self.n_qubits)]
+
+    def sample_bitstrings(self, k: int, rng: np.random.Generator = None) -> np.ndarray:
+        # Samples k Z-basis outcomes of all qubits without collapsing the state.
+        # Outcomes form the affine space b_0 + span(x parts of the X-type generators),
+        # so one elimination on a copy of the tableau serves every sample.
+        # Returns a (k, n_qubits) uint8 array, bit 1 <-> eigenvalue -1 of Z_j.
+
+        if(rng is None):
+            rng = np.random.default_rng()
+
+        n = self.n_qubits
+        x = self.check_matrix[:, :n].copy()
+        z = self.check_matrix[:, n:].copy()
+        phase = self.phase.copy()
+
+        # Gauss-Jordan on the x block, X-type generators end up in rows [0, rank)
+        rank = 0
+        for col in range(n):
+            candidates = np.flatnonzero(x[rank:, col])
+            if(len(candidates) == 0):
+                continue
+
+            pivot = rank + candidates[0]
+            swap_rows(x, z, phase, rank, pivot)
+
+            targets = np.flatnonzero(x[:, col])
+            targets = targets[targets != rank]
+            multiply_rows(x, z, phase, targets, rank)
+            rank += 1
+
+        # Remaining rows are Z-type: z.b = 0 for phase +1 and z.b = 1 for phase -1
+        z_rows = z[rank:].copy()
+        parity = np.array([has_sign(p) for p in phase[rank:]], dtype = bool)
+
+        pivot_cols = []
+        row = 0
+        for col in range(n):
+            candidates = np.flatnonzero(z_rows[row:, col])
+            if(len(candidates) == 0):
+                continue
+
+            pivot = row + candidates[0]
+            z_rows[[row, pivot]] = z_rows[[pivot, row]]
+            parity[[row, pivot]] = parity[[pivot, row]]
+
+            targets = np.flatnonzero(z_rows[:, col])
+            targets = targets[targets != row]
+            z_rows[targets] ^= z_rows[row]
+            parity[targets] ^= parity[row]
+
+            pivot_cols.append(col)
+            row += 1
+            if(row == len(z_rows)):
+                break
+
+        offset = np.zeros((n,), dtype = bool)
+        offset[pivot_cols] = parity[:len(pivot_cols)]
+
+        # samples = offset + coefficients @ x[:rank] over GF(2), bit-packed along the qubits
+        basis = np.packbits(x[:rank], axis = 1)
+        coefficients = rng.integers(0, 2, size = (k, rank), dtype = np.uint8).astype(bool)
+
+        samples = np.tile(np.packbits(offset), (k, 1))
+        for generator in range(rank):
+            samples[coefficients[:, generator]] ^= basis[generator]
+
+        return np.unpackbits(samples, axis = 1, count = n)
 
     def show(self):
-        for row in range(self.n_qubits):
-            stabilizer = str(self.phase[row])
-            for qubit_no in range(self.n_qubits):
-                stabilizer += self.getPauli(row, qubit_no)
-            print(f"{row} : {stabilizer}")
+        paulis = self.get_pauli_array()
+
+        lines = [f"{row} : {self.phase[row]}" + paulis[row].tobytes().decode("ascii")
+                 for row in range(self.n_qubits)]
+        print("\n".join(lines))
     
 
 
@@ -226,20 +370,88 @@ class MatrixSimulator:
         return table
 
 
-    def execute(self, circuit: Circuit) -> CheckMatrixState:
-        
+    def execute(self, circuit: Circuit, rng: np.random.Generator = None) -> CheckMatrixState:
+
+        state = CheckMatrixState(circuit.n_qubits)
+        state.init_basis_state()
+
+        return self.run_instructions(state, circuit.get_instructions(), rng)
+
+    def sample(self, circuit: Circuit, shots: int, rng: np.random.Generator = None) -> np.ndarray:
+        # Outcomes of the trailing Z measurements (e.g. measure_all) as a (shots, n_measured)
+        # uint8 array in measurement order. Bit 0 / 1 <-> eigenvalue +1 / -1, where
+        # apply_measurement reports +1 / -1.
+        # Without earlier measurements all shots share the final state and are sampled from it
+        # directly. Otherwise shots are grouped by their earlier measurement outcomes, a random
+        # measurement splits every group binomially and each group is sampled from its own state.
+
+        if(rng is None):
+            rng = np.random.default_rng()
+
+        instructions = circuit.get_instructions()
+        end, measured = circuit.get_final_measurements()
+
+        first_measurement = end
+        for index, instruction in enumerate(instructions[:end]):
+            if not (instruction.is_gate()):
+                first_measurement = index
+                break
+
         state = CheckMatrixState(circuit.n_qubits)
         state.init_basis_state()
+        state = self.run_instructions(state, instructions[:first_measurement], rng, verbose = False)
 
-        for instruction in circuit.get_instructions():
+        if(first_measurement == end):
+            return state.sample_bitstrings(shots, rng)[:, measured]
+
+        # (state, number of shots) for every measurement history drawn so far
+        groups = [(state, shots)]
+
+        for instruction in instructions[first_measurement:end]:
+            if(instruction.is_gate()):
+                groups = [(self.run_instructions(group_state, [instruction], rng, verbose = False), count)
+                          for group_state, count in groups]
+                continue
+
+            split_groups = []
+            for group_state, count in groups:
+                minus_state = group_state.copy()
+                results = [measured_state.apply_measurement(qubits = instruction.get_qubits(),
+                                                            operator = instruction.get_operator(),
+                                                            phase = instruction.get_phase(),
+                                                            outcome = outcome)
+                           for measured_state, outcome in [(group_state, 1), (minus_state, -1)]]
+
+                if(results[0] == results[1]):
+                    split_groups.append((group_state, count))
+                    continue
+
+                plus_count = rng.binomial(count, 0.5)
+                split_groups += [(split_state, split_count)
+                                 for split_state, split_count in [(group_state, plus_count), (minus_state, count - plus_count)]
+                                 if split_count > 0]
+
+            groups = split_groups
+
+        samples = np.zeros((0, len(measured)), dtype = np.uint8)
+        samples = np.concatenate([samples] + [group_state.sample_bitstrings(count, rng)[:, measured]
+                                              for group_state, count in groups])
+
+        return samples[rng.permutation(shots)]
+
+    def run_instructions(self, state: CheckMatrixState, instructions: list,
+                         rng: np.random.Generator = None, verbose: bool = True) -> CheckMatrixState:
+
+        for instruction in instructions:
             if(instruction.is_gate()):
                 state.apply_gate(qubits = instruction.get_qubits(),
                                          pauli_gate_map = self.lookup_table[instruction.get_name()])
             else:
                 res = state.apply_measurement(qubits = instruction.get_qubits(), 
                                               operator = instruction.get_operator(), 
-                                              phase = instruction.get_phase())
-                print(f"M: qubit {instruction.get_qubits()} measured {res} for operator {instruction.get_operator()}")
+                                              phase = instruction.get_phase(),
+                                              rng = rng)
+                if(verbose):
+                    print(f"M: qubit {instruction.get_qubits()} measured {res} for operator {instruction.get_operator()}")
 
         return state
-
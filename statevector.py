@@ -0,0 +1,133 @@
+import numpy as np
+
+import gate_tools
+from circuit import Circuit
+
+# Dense reference for differential testing, memory grows as 2^n
+MAX_QUBITS = 14
+
+class StateVector:
+    def __init__(self, n_qubits: int):
+        # amplitudes as tensor of shape [2] * n_qubits, axis j <-> qubit j (qubit 0 most significant)
+
+        if(n_qubits > MAX_QUBITS):
+            raise RuntimeError(f"State vector of {n_qubits} qubits exceeds MAX_QUBITS {MAX_QUBITS}")
+
+        self.n_qubits = n_qubits
+        self.amplitudes = np.zeros((2,) * n_qubits, dtype = np.complex128)
+
+    def init_basis_state(self):
+        # Initialize to |0..0>
+
+        self.amplitudes[...] = 0
+        self.amplitudes[(0,) * self.n_qubits] = 1
+
+    def apply_matrix(self, qubits: list, matrix: np.ndarray, amplitudes: np.ndarray = None) -> np.ndarray:
+        # contracts a 2^k x 2^k matrix with the k qubit axes instead of building the full np.kron operator
+
+        if(amplitudes is None):
+            amplitudes = self.amplitudes
+
+        k = len(qubits)
+        tensor = matrix.reshape((2,) * (2 * k))
+
+        result = np.tensordot(tensor, amplitudes, axes = (list(range(k, 2 * k)), qubits))
+        return np.moveaxis(result, list(range(k)), qubits)
+
+    def apply_gate(self, qubits: list, gate_name: str):
+        self.amplitudes = self.apply_matrix(qubits, gate_tools.to_matrix(gate_name))
+
+    def apply_pauli(self, qubits: list, operator: str, amplitudes: np.ndarray = None) -> np.ndarray:
+
+        if(amplitudes is None):
+            amplitudes = self.amplitudes
+
+        for qubit_no, pauli in zip(qubits, operator):
+            if(pauli != "I"):
+                amplitudes = self.apply_matrix([qubit_no], gate_tools.to_matrix(pauli), amplitudes)
+
+        return amplitudes
+
+    def apply_measurement(self, qubits: list, operator: str, phase: np.complex64,
+                          rng: np.random.Generator = None) -> int:
+        # projective measurement of phase * operator, returns the eigenvalue +1 / -1
+
+        if(rng is None):
+            rng = np.random.default_rng()
+
+        flipped = phase * self.apply_pauli(qubits, operator)
+        plus = (self.amplitudes + flipped) / 2
+        probability = np.real(np.vdot(plus, plus))
+
+        if(rng.random() < probability):
+            self.amplitudes = plus / np.sqrt(probability)
+            return 1
+
+        minus = (self.amplitudes - flipped) / 2
+        self.amplitudes = minus / np.sqrt(1 - probability)
+        return -1
+
+    def expectation(self, pauli_string: str, phase: np.complex64 = 1) -> complex:
+        # <psi| phase * P |psi>
+
+        transformed = self.apply_pauli(list(range(self.n_qubits)), pauli_string)
+        return phase * np.vdot(self.amplitudes, transformed)
+
+    def get_probabilities(self) -> np.ndarray:
+        # Z-basis outcome probabilities, shape [2] * n_qubits
+        return np.abs(self.amplitudes) ** 2
+
+
+class StateVectorSimulator:
+
+    def __init__(self, rng: np.random.Generator = None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def execute(self, circuit: Circuit) -> StateVector:
+
+        state = StateVector(circuit.n_qubits)
+        state.init_basis_state()
+
+        for instruction in circuit.get_instructions():
+            if(instruction.is_gate()):
+                state.apply_gate(qubits = instruction.get_qubits(),
+                                 gate_name = instruction.get_name())
+            else:
+                state.apply_measurement(qubits = instruction.get_qubits(),
+                                        operator = instruction.get_operator(),
+                                        phase = instruction.get_phase(),
+                                        rng = self.rng)
+
+        return state
+
+    def get_distribution(self, circuit: Circuit, stop: int = None) -> np.ndarray:
+        # exact Z-basis outcome probabilities after the first `stop` instructions (all by default),
+        # averaged over the outcomes of all measurements by following every branch with nonzero
+        # probability. Final Z measurements do not change the distribution, stopping before them
+        # avoids up to 2^n branches.
+
+        state = StateVector(circuit.n_qubits)
+        state.init_basis_state()
+
+        # unnormalized branches, the squared norm is the probability of the branch
+        branches = [state.amplitudes]
+
+        for instruction in circuit.get_instructions()[:stop]:
+            qubits = instruction.get_qubits()
+
+            if(instruction.is_gate()):
+                matrix = gate_tools.to_matrix(instruction.get_name())
+                branches = [state.apply_matrix(qubits, matrix, amplitudes) for amplitudes in branches]
+                continue
+
+            projected_branches = []
+            for amplitudes in branches:
+                flipped = instruction.get_phase() * state.apply_pauli(qubits, instruction.get_operator(), amplitudes)
+
+                for projected in [(amplitudes + flipped) / 2, (amplitudes - flipped) / 2]:
+                    if(np.real(np.vdot(projected, projected)) > 1e-12):
+                        projected_branches.append(projected)
+
+            branches = projected_branches
+
+        return sum(np.abs(amplitudes) ** 2 for amplitudes in branches)